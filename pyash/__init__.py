@@ -1,40 +1,109 @@
 import datetime
-from functools import total_ordering
+from collections import defaultdict
+from operator import attrgetter
 from pprint import pprint
+from sys import intern
 
 from chut import console_script
 from decimal import Decimal
-from jinja2 import Template
+from jinja2 import Environment
 
 DATE_FMT = '%Y/%m/%d'
 
-table = Template('''
-{%- for label, amount in values %}
-{{ '+-{0:20s}+{1:11s}-+'.format('-' * 20, '-' * 11) }}
-{{ '| {0:20s}|{1:11.2f} |'.format(label, amount) }}
-{%- endfor %}
-{{ '+-{0:20s}+{1:11s}-+'.format('-' * 20, '-' * 11) }}
-''')
+_SKIP_SET = frozenset(('$', '!', '#', '-'))
+_JSON_FIELDS = ('category', 'status', 'kind')
+
+env = Environment(trim_blocks=True, lstrip_blocks=True,
+                  auto_reload=False, cache_size=-1)
+
+_SEP = '+' + '-' * 21 + '+' + '-' * 12 + '+'
+_ROW = '| {0:20s}|{1:11.2f} |'.format
 
 
 def render_table(values):
-    return table.render(values=values) + '\n'
+    lines = [_SEP]
+    for label, amount in values:
+        lines.append(_ROW(label, amount))
+        lines.append(_SEP)
+    return '\n' + '\n'.join(lines) + '\n'
+
+
+def to_cents(amount):
+    cents = amount * 100
+    if not cents.is_finite() or cents != cents.to_integral_value():
+        raise ValueError(
+            'Le montant {} a plus de deux décimales'.format(amount))
+    return int(cents)
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def parse_date(date_str):
+    if len(date_str) == 10 and date_str[4] == date_str[7] == '/':
+        return datetime.datetime(
+            int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+    return datetime.datetime.strptime(date_str, DATE_FMT)
 
 
 class Balance(dict):
 
-    def __init__(self, reverse=False):
+    def __init__(self, reverse=False, totals=()):
+        super().__init__(totals)
         self.reverse = reverse
         self.coef = reverse and 1 or -1
         self.title = reverse and 'Recettes' or 'Dépenses'
+        self._reset()
+
+    def _reset(self):
+        self._sorted_cache = None
+        self._sum_cache = None
+
+    def __setitem__(self, key, value):
+        self._reset()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._reset()
+        super().__delitem__(key)
+
+    def __ior__(self, other):
+        self._reset()
+        return super().__ior__(other)
+
+    def clear(self):
+        self._reset()
+        super().clear()
+
+    def pop(self, *args):
+        self._reset()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._reset()
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self._reset()
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._reset()
+        super().update(*args, **kwargs)
 
     def __iter__(self):
-        items = sorted([(v * self.coef, k) for k, v in self.items()],
-                       reverse=True)
-        return iter([(k, v) for v, k in items])
+        if self._sorted_cache is None:
+            coef = self.coef
+            items = sorted(self.items(),
+                           key=lambda kv: (kv[1] * coef, kv[0]), reverse=True)
+            self._sorted_cache = [(k, v * coef) for k, v in items]
+        return iter(self._sorted_cache)
 
     def sum(self):
-        return sum(self.values()) * self.coef
+        if self._sum_cache is None:
+            self._sum_cache = sum(self.values()) * self.coef
+        return self._sum_cache
 
     def __str__(self):
         title = '%s\n%s\n' % (self.title, '=' * len(self.title))
@@ -42,56 +111,63 @@ class Balance(dict):
         return title + render_table(values)
 
 
-@total_ordering
-class Move(dict):
+class Move:
 
-    template = Template('''
+    fields = ('date', 'amount', 'amount_cents', 'category', 'status', 'kind',
+              'description', 'comment')
+    __slots__ = ('index', 'line_number', 'date_str', '_search_blob') + fields
+
+    template = env.from_string('''
 {{ m.date }} {{ m.amount }}€ {{m.kind}} {{ m.category }} {{ m.status }}
     {{ m.description }}
     {{ m.comment or '' }}
 ''')
+    _render = template.render
 
     def __init__(self, m, i, line):
         self.index = m
         self.line_number = i
         date_str, amount_str, kind, category, status = line.strip().split(' ')
-        date = datetime.datetime.strptime(date_str, DATE_FMT)
-        amount = Decimal(amount_str.rstrip('\u20ac'))
-        self.update({
-            'date': date,
-            'amount': amount,
-            'category': category,
-            'status': status,
-            'kind': kind,
-            'description': None,
-            'comment': '',
-        })
-
-    def __getattr__(self, attr):
-        return self[attr]
+        self.date = parse_date(date_str)
+        if len(date_str) != 10:
+            date_str = self.date.strftime(DATE_FMT)
+        self.date_str = date_str
+        self.amount = Decimal(amount_str.rstrip('\u20ac'))
+        self.amount_cents = to_cents(self.amount)
+        self.category = intern(category)
+        self.status = intern(status)
+        self.kind = intern(kind)
+        self.description = None
+        self.comment = ''
+        self._search_blob = None
 
     def add(self, line):
         if line.strip():
-            if self['description'] is None:
-                self['description'] = line.strip()
+            if self.description is None:
+                self.description = line.strip()
             else:
-                self['comment'] += line.strip(' ')
-
-    def __lt__(self, other):
-        return self['date'] < other['date']
-
-    def __eq__(self, other):
-        return self['date'] == other['date']
+                self.comment += line.strip(' ')
+
+    @property
+    def search_blob(self):
+        blob = self._search_blob
+        if blob is None:
+            blob = '{} {}\u20ac {} {} {} {} {}'.format(
+                self.date_str, self.amount,
+                self.kind, self.category, self.status,
+                self.description or '', self.comment).lower()
+            self._search_blob = blob
+        return blob
 
     def __str__(self):
-        m = dict(self.copy())
-        m['date'] = self['date'].strftime(DATE_FMT)
-        return self.template.render(m=m).strip() + '\n\n'
+        m = {k: getattr(self, k) for k in self.fields}
+        m['date'] = self.date_str
+        return self._render(m=m).strip() + '\n\n'
 
 
 class MovesFile:
 
-    def __init__(self, args):
+    def __init__(self, args, compute_balances=True):
         self.args = args
         if '-s' in args:
             self.start_date = datetime.datetime.strptime(args['-s'], DATE_FMT)
@@ -105,39 +181,43 @@ class MovesFile:
         else:
             self.end_date = datetime.datetime.strptime(args['-e'], DATE_FMT)
 
-        self.accounts = {}
+        self.grep = (args.get('-g') or '').lower()
+        self._account_cents = {}
         self.kinds = {}
-        self.moves = sorted(self.parse())
+        moves = list(self.parse())
+        moves.sort(key=attrgetter('date'))
+        self.moves = moves
+        totals_in = defaultdict(int)
+        totals_out = defaultdict(int)
+        if compute_balances:
+            for move in self.moves:
+                amount = move.amount_cents
+                if amount > 0:
+                    totals_in[move.category] += amount
+                else:
+                    totals_out[move.category] += amount
+            if self._account_cents:
+                accounts = self._account_cents
+                kinds = self.kinds
+                for move in self.moves:
+                    account = kinds.get(move.kind)
+                    if account is None:
+                        raise TypeError(
+                            'Le type {} est inconnu'.format(move.kind))
+                    accounts[account] += move.amount_cents
         self.balances = {
-            'in': Balance(reverse=True),
-            'out': Balance(),
+            'in': Balance(reverse=True, totals={
+                k: from_cents(v) for k, v in totals_in.items()}),
+            'out': Balance(totals={
+                k: from_cents(v) for k, v in totals_out.items()}),
         }
-        for move in self.moves:
-            if move['amount'] > 0:
-                balance = self.balances['in']
-            else:
-                balance = self.balances['out']
-
-            category = move['category']
-            if category in balance:
-                balance[category] += move['amount']
-            else:
-                balance[category] = move['amount']
-
-            if self.accounts:
-                if move['kind'] in self.kinds:
-                    account = self.kinds[move['kind']]
-                    self.accounts[account] += move['amount']
-                else:
-                    raise TypeError(
-                        'Le type {} est inconnu'.format(move['kind']))
+        self.accounts = {
+            k: from_cents(v) for k, v in self._account_cents.items()}
 
     def title(self):
-        start_date = self.moves[0]['date']
-        end_date = self.moves[-1]['date']
         title = 'Période du %s au %s\n' % (
-            start_date.strftime(DATE_FMT),
-            end_date.strftime(DATE_FMT)
+            self.moves[0].date_str,
+            self.moves[-1].date_str
         )
         sep = '=' * len(title)
         sep += '\n'
@@ -154,71 +234,55 @@ class MovesFile:
         return render_table(values=values)
 
     def iterator(self):
+        with open(self.args['-i'], buffering=1 << 20) as fd:
+            lines = fd.readlines()
+        start, end = 0, len(lines)
         if self.args.get('--period'):
             periode = '-- ' + self.args['--period']
-        else:
-            periode = None
-        i = 0
-        with open(self.args['-i']) as fd:
-            for line in fd:
-                i += 1
-                if periode and periode is not True:
-                    if line.startswith(periode):
-                        periode = True
-                    continue
-                if periode is True and line.startswith('!'):
-                    return
-                if line[0] in '$!#-':
-                    continue
-                yield i, line
+            start = end
+            for k, line in enumerate(lines):
+                if line.startswith(periode):
+                    start = k + 1
+                    break
+            for k in range(start, end):
+                if lines[k].startswith('!'):
+                    end = k
+                    break
+        for i in range(start, end):
+            line = lines[i]
+            if line[:1] in _SKIP_SET:
+                continue
+            yield i + 1, line
 
     def parse(self):
         move = None
-        fd = self.iterator()
-        i, line = next(fd)
         m = 0
-        while True:
-            if line.startswith('++ '):
+        for i, line in self.iterator():
+            c0 = line[:1]
+            if c0.isdigit() and line[:4].isdigit():
+                if move is not None and self.filter(move):
+                    yield move
+                m += 1
+                move = Move(m, i, line)
+            elif move is not None:
+                move.add(line)
+            elif c0 == '+' and line[1:3] == '+ ':
                 account, kinds, amount = line.split()[1:]
                 kinds = kinds[1:-2].split(',')
-                amount = Decimal(amount)
-                self.accounts[account] = amount
+                self._account_cents[account] = to_cents(Decimal(amount))
                 for kind in kinds:
-                    self.kinds[kind] = account
-                try:
-                    i, line = next(fd)
-                except StopIteration:
-                    return
-            elif line[:4].isdigit():
-                m += 1
-                move = Move(m, i, line)
-                try:
-                    i, line = next(fd)
-                except StopIteration:
-                    return
-                while not line[:4].isdigit():
-                    move.add(line)
-                    try:
-                        i, line = next(fd)
-                    except StopIteration:
-                        break
-                if self.filter(move):
-                    yield move
-            else:
-                try:
-                    i, line = next(fd)
-                except StopIteration:
-                    return
+                    self.kinds[intern(kind)] = account
+        if move is not None and self.filter(move):
+            yield move
 
     def filter(self, move):
-        g = self.args.get('-g', '')
-        if g and g not in str(move).lower():
+        if self.grep and self.grep not in move.search_blob:
             return
-        if self.args.get('-p') and not move['status'].upper() == 'P':
+        if self.args.get('-p') and not move.status.upper() == 'P':
             return
-        if self.args.get('-x') and not move['status'].upper() == 'X':
+        if self.args.get('-x') and not move.status.upper() == 'X':
             return
-        if self.start_date <= move['date'] <= self.end_date:
+        if self.start_date <= move.date <= self.end_date:
             return True
 
 
@@ -243,21 +307,17 @@ def pyash(args):
         from . import paypal
         paypal.import_csv(args['<csv>'])
     if args['validate']:
-        out = ''
         moves = MovesFile({'-i': args['-i']})
         for m in moves.moves:
-            out += str(m)
+            str(m)
         return
     if args['json']:
-        out = {}
-        moves = MovesFile({'-i': args['-i']})
+        out = {k: set() for k in _JSON_FIELDS}
+        moves = MovesFile({'-i': args['-i']}, compute_balances=False)
         for m in moves.moves:
-            for k, v in m.items():
-                if k not in ('amount', 'date', 'description', 'comment'):
-                    s = out.setdefault(k, set())
-                    s.add(v)
-        for k, v in out.items():
-            out[k] = sorted(v)
+            for k in _JSON_FIELDS:
+                out[k].add(getattr(m, k))
+        out = {k: sorted(v) for k, v in out.items()}
         pprint(out)
         return
     moves = MovesFile(args)
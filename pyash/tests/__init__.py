@@ -1,7 +1,10 @@
+import copy
+import datetime
 import os.path
 import unittest
+from decimal import Decimal
 
-from pyash import MovesFile
+from pyash import Balance, MovesFile, parse_date
 
 ROOT = os.path.dirname(__file__)
 
@@ -13,6 +16,63 @@ class TestSequenceFunctions(unittest.TestCase):
         moves_list = list(moves.parse())
         self.assertEqual(4, len(moves_list))
 
+    def test_balances(self):
+        moves = MovesFile({'-i': os.path.join(ROOT, 'normal.dat')})
+        self.assertEqual(Decimal('90.00'), moves.balances['in'].sum())
+        self.assertEqual(Decimal('5.54'), moves.balances['out'].sum())
+        self.assertEqual([('Don', Decimal('50.00')),
+                          ('Cotisation', Decimal('40.00'))],
+                         list(moves.balances['in']))
+        self.assertEqual(Decimal('50.00'), moves.balances['in']['Don'])
+
+    def test_without_balances(self):
+        moves = MovesFile({'-i': os.path.join(ROOT, 'normal.dat')},
+                          compute_balances=False)
+        self.assertEqual(4, len(moves.moves))
+        self.assertEqual({}, dict(moves.balances['in']))
+
+    def test_grep_ignores_case(self):
+        moves = MovesFile({'-i': os.path.join(ROOT, 'normal.dat'),
+                           '-g': 'DEXTER'})
+        self.assertEqual(2, len(moves.moves))
+
+    def test_balance_cache(self):
+        balance = Balance(True, {'Don': Decimal('50.00')})
+        self.assertEqual([('Don', Decimal('50.00'))], list(balance))
+        self.assertEqual(Decimal('50.00'), balance.sum())
+        balance['Cotisation'] = Decimal('80.00')
+        self.assertEqual([('Cotisation', Decimal('80.00')),
+                          ('Don', Decimal('50.00'))], list(balance))
+        self.assertEqual(Decimal('130.00'), balance.sum())
+        balance.update(Don=Decimal('10.00'))
+        del balance['Cotisation']
+        self.assertEqual([('Don', Decimal('10.00'))], list(balance))
+        self.assertEqual(Decimal('10.00'), balance.sum())
+
+    def test_balance_copy(self):
+        moves = MovesFile({'-i': os.path.join(ROOT, 'normal.dat')})
+        balance = copy.copy(moves.balances['in'])
+        self.assertEqual(list(moves.balances['in']), list(balance))
+        with self.assertRaises(KeyError):
+            balance['Unknown']
+
+    def test_sub_cent_amount(self):
+        with self.assertRaises(ValueError):
+            MovesFile({'-i': os.path.join(ROOT, 'sub_cent_amount.dat')})
+
+    def test_trailing_zeros(self):
+        moves = MovesFile({'-i': os.path.join(ROOT, 'trailing_zeros.dat')})
+        self.assertEqual(Decimal('10.50'), moves.balances['in'].sum())
+        self.assertEqual({'Banque': Decimal('110.50')}, moves.accounts)
+
+    def test_parse_date(self):
+        self.assertEqual(datetime.datetime(2006, 1, 14),
+                         parse_date('2006/01/14'))
+        self.assertEqual(datetime.datetime(2006, 1, 14),
+                         parse_date('2006/1/14'))
+        with self.assertRaises(ValueError):
+            parse_date('2006-01-14')
+
     def test_file_not_exist(self):
         with self.assertRaises(FileNotFoundError):
             MovesFile({'-i': os.path.join(ROOT, 'idonotexist')})
@@ -28,6 +88,12 @@ class TestSequenceFunctions(unittest.TestCase):
         moves_list = list(moves.parse())
         self.assertEqual(4, len(moves_list))
 
+    def test_no_trailing_lines(self):
+        moves = MovesFile(
+            {'-i': os.path.join(ROOT, 'no_trailing_lines.dat')})
+        moves_list = list(moves.parse())
+        self.assertEqual(2, len(moves_list))
+
     # trop de lignes entre deux mouvements
     # trop de lignes avant le 1er mouvement
     # trop de lignes après le 2 mouvement